@@ -1,35 +1,131 @@
 import os
-import io
+import asyncio
+import anyio.to_thread
+import logging
+import random
+import time
 import zipfile
-import requests
+import httpx
 import hashlib
+import hmac
+import json
 import secrets
 import string
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
-from typing import Optional, List, Dict, Any
+from itertools import chain
+from typing import Optional, List, Dict, Any, BinaryIO, AsyncIterator, Iterator, Callable, Tuple, TypeVar
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Header
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 from supabase import create_client, Client
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 
 APP_VERSION = "v2026-02-08-p0-guards-download-delete-recoverycode"
 
-app = FastAPI(title="findme-api", version=APP_VERSION)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # threads para los handlers sync (supabase-py es sync); default de anyio = 40
+    anyio.to_thread.current_default_thread_limiter().total_tokens = SYNC_THREADPOOL_SIZE
+    # un solo AsyncClient (pool keep-alive) para las llamadas REST directas a Supabase
+    app.state.http = httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    )
+    # PostgREST async para el endpoint de polling (/jobs): no ocupa threads del pool
+    app.state.pg = None
+    if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
+        app.state.pg = AsyncPostgrestClient(
+            f"{SUPABASE_URL}/rest/v1",
+            headers={
+                **DEFAULT_POSTGREST_CLIENT_HEADERS,
+                "apikey": SUPABASE_SERVICE_ROLE_KEY,
+                "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+            },
+            timeout=HTTP_TIMEOUT_SECONDS,
+        )
+    # /upload-request sólo si el bucket limita el tamaño (la URL firmada no lo hace)
+    app.state.signed_uploads_enabled = False
+    sweeper = None
+    if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
+        app.state.signed_uploads_enabled = await _uploads_bucket_size_limited(app.state.http)
+        sweeper = asyncio.create_task(_upload_sweeper())
+    try:
+        yield
+    finally:
+        if sweeper is not None:
+            sweeper.cancel()
+        await app.state.http.aclose()
+        if app.state.pg is not None:
+            await app.state.pg.aclose()
+        HTTP_CLIENT.close()
+
+
+app = FastAPI(
+    title="findme-api",
+    version=APP_VERSION,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+logger = logging.getLogger("findme-api")
 
 # -----------------------------
 # Config
 # -----------------------------
 UPLOADS_BUCKET = os.getenv("SUPABASE_BUCKET_UPLOADS", "uploads")
+SUPABASE_URL = os.getenv("SUPABASE_URL", "").rstrip("/")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+# prefijo de URLs públicas, armado una sola vez ("" si no hay SUPABASE_URL)
+PUBLIC_UPLOADS_PREFIX = f"{SUPABASE_URL}/storage/v1/object/public/{UPLOADS_BUCKET}/" if SUPABASE_URL else ""
 
 # P0 guards (API-side)
 MAX_ZIP_MB = int(os.getenv("MAX_ZIP_MB", "50"))
 MAX_PHOTOS_PER_ALBUM = int(os.getenv("MAX_PHOTOS_PER_ALBUM", "500"))
+MAX_PHOTO_MB = int(os.getenv("MAX_PHOTO_MB", "25"))  # tamaño descomprimido por foto (anti zip-bomb)
 HTTP_TIMEOUT_SECONDS = int(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "16"))
+# Bulkheads: tope de llamadas simultáneas a Storage para todo el proceso
+STORAGE_FETCH_SLOTS = int(os.getenv("STORAGE_FETCH_SLOTS", "32"))
+STORAGE_DELETE_SLOTS = int(os.getenv("STORAGE_DELETE_SLOTS", "4"))
+STORAGE_REMOVE_BATCH = 100  # paths por llamada a storage.remove
+PGREST_IN_BATCH = 200  # ids por filtro in_() (~37 bytes c/u en la URL)
+SYNC_THREADPOOL_SIZE = int(os.getenv("SYNC_THREADPOOL_SIZE", "100"))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# ZIPs en zips/ sin álbum que los referencie se borran pasado este TTL (uploads firmados nunca confirmados)
+UNCONFIRMED_UPLOAD_TTL_SECONDS = int(os.getenv("UNCONFIRMED_UPLOAD_TTL_SECONDS", "86400"))
+UPLOAD_SWEEP_SECONDS = int(os.getenv("UPLOAD_SWEEP_SECONDS", "3600"))
+# cada barrido mira sólo [cutoff - ventana, cutoff); 2x el intervalo tolera una corrida perdida
+UPLOAD_SWEEP_WINDOW_SECONDS = int(os.getenv("UPLOAD_SWEEP_WINDOW_SECONDS", str(2 * UPLOAD_SWEEP_SECONDS)))
+
+# Reintentos ante fallas transitorias de Supabase (red / 429 / 5xx de gateway)
+HTTP_RETRY_ATTEMPTS = int(os.getenv("HTTP_RETRY_ATTEMPTS", "4"))
+
+# Circuit breaker: tras N fallas seguidas cortamos llamadas durante RESET segundos
+CIRCUIT_FAIL_MAX = int(os.getenv("CIRCUIT_FAIL_MAX", "5"))
+CIRCUIT_RESET_SECONDS = int(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Caches cortos para lecturas de polling (ms)
+JOB_STATUS_CACHE_TTL_MS = int(os.getenv("JOB_STATUS_CACHE_TTL_MS", "250"))
+CLUSTERS_CACHE_TTL_MS = int(os.getenv("CLUSTERS_CACHE_TTL_MS", "2000"))
 
 # Recovery code (anti-abuse)
 ALBUM_CODE_SALT = os.getenv("ALBUM_CODE_SALT", "")  # REQUIRED in Fly secrets for API
+# X-Album-Token: prueba de acceso firmada, válida por N segundos (evita releer albums en cada poll)
+ALBUM_TOKEN_TTL_SECONDS = int(os.getenv("ALBUM_TOKEN_TTL_SECONDS", "900"))
 
 
 # -----------------------------
@@ -45,32 +141,337 @@ def _parse_allowed_origins() -> List[str]:
 
 ALLOWED_ORIGINS = _parse_allowed_origins()
 
+# -----------------------------
+# Upload body limit (corta el stream, no espera a tener todo el body)
+# -----------------------------
+# margen para boundaries/headers del multipart sobre el tamaño del ZIP
+_MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects POST /upload with 413 straight from the declared Content-Length, and
+    otherwise counts body bytes as they are received, aborting once the limit is
+    crossed, before Starlette spools the rest.
+    """
+
+    def __init__(self, app, path: str, max_bytes: int) -> None:
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        # Content-Length declarado: rechazamos sin leer un solo byte del body
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                # más de 15 dígitos ya excede cualquier límite (y evita el tope de int())
+                if value.isdigit() and (len(value) > 15 or int(value) > self.max_bytes):
+                    response = ORJSONResponse(
+                        status_code=413, content={"detail": f"ZIP too large. Max {MAX_ZIP_MB}MB"}
+                    )
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI re-lanza HTTPException al parsear el form => sale como 413
+                    raise HTTPException(status_code=413, detail=f"ZIP too large. Max {MAX_ZIP_MB}MB")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    path="/upload",
+    max_bytes=MAX_ZIP_MB * 1024 * 1024 + _MULTIPART_OVERHEAD_BYTES,
+)
+
+# CORS se registra después => queda por fuera del límite de upload: el 413 que
+# responde UploadSizeLimitMiddleware también lleva access-control-allow-origin.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # listas explícitas: el preflight no tiene que reflejar lo que pida el browser
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization", "X-Album-Code", "X-Album-Token", "If-None-Match"],
     expose_headers=["*"],
     max_age=86400,
 )
 
+# -----------------------------
+# Gzip (solo JSON; el ZIP de /download ya va comprimido/STORED)
+# -----------------------------
+class JSONGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves the streamed cluster ZIP downloads untouched."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/download"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # -----------------------------
 # Supabase
 # -----------------------------
+_SB_CLIENT: Optional[Client] = None
+_SB_LOCK = threading.Lock()
+
+
 def supabase_admin() -> Client:
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    if not url or not key:
-        raise RuntimeError("Missing Supabase envs")
-    return create_client(url, key)
+    """
+    Returns a process-wide Supabase client, created lazily on first use so the
+    underlying HTTP sessions (and their keep-alive pools) are reused across requests.
+    """
+    global _SB_CLIENT
+    if _SB_CLIENT is not None:
+        return _SB_CLIENT
+    with _SB_LOCK:
+        if _SB_CLIENT is None:
+            if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+                raise RuntimeError("Missing Supabase envs")
+            _SB_CLIENT = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    return _SB_CLIENT
+
+
+# -----------------------------
+# Retries (backoff exponencial + full jitter)
+# -----------------------------
+T = TypeVar("T")
+
+_RETRY_STATUS = frozenset({429, 502, 503, 504})
+
+
+def _with_retries(
+    call: Callable[[], T],
+    retry_exc: Tuple[type, ...] = (),
+    retry_if: Optional[Callable[[T], bool]] = None,
+    retry_exc_if: Optional[Callable[[BaseException], bool]] = None,
+) -> T:
+    """
+    Runs `call` up to HTTP_RETRY_ATTEMPTS times. Only for idempotent calls:
+    retries on `retry_exc` (narrowed by `retry_exc_if`, if given) or when
+    `retry_if(result)` is true; the last attempt always raises / returns as-is.
+    """
+    attempts = max(1, HTTP_RETRY_ATTEMPTS)
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        try:
+            result = call()
+        except retry_exc as exc:
+            if last or (retry_exc_if is not None and not retry_exc_if(exc)):
+                raise
+        else:
+            if last or retry_if is None or not retry_if(result):
+                return result
+        time.sleep(random.uniform(0, min(5.0, 0.2 * (2 ** attempt))))
+    raise AssertionError("unreachable")
+
+
+# -----------------------------
+# Circuit breakers (Storage / PostgREST)
+# -----------------------------
+class CircuitOpenError(Exception):
+    pass
+
+
+class _CircuitBreaker:
+    """
+    Minimal thread-safe breaker: opens after `fail_max` consecutive failures,
+    rejects calls for `reset_timeout` seconds, then lets traffic through again
+    (half-open) and closes on the first success or re-opens on the first failure.
+    """
+
+    def __init__(self, name: str, fail_max: int, reset_timeout: float) -> None:
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open = False
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{self.name} circuit open")
+            self._opened_at = None
+            self._half_open = True
+            logger.info("circuit %s half-open", self.name)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._half_open:
+                self._half_open = False
+                logger.info("circuit %s closed", self.name)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is None and (self._half_open or self._failures >= self.fail_max):
+                self._opened_at = time.monotonic()
+                self._half_open = False
+                logger.warning("circuit %s opened after %d failures", self.name, self._failures)
+
+
+_STORAGE_BREAKER = _CircuitBreaker("storage", CIRCUIT_FAIL_MAX, CIRCUIT_RESET_SECONDS)
+_PGREST_BREAKER = _CircuitBreaker("postgrest", CIRCUIT_FAIL_MAX, CIRCUIT_RESET_SECONDS)
+
+
+@app.exception_handler(CircuitOpenError)
+async def _circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return ORJSONResponse(status_code=503, content={"detail": "Upstream temporarily unavailable"})
+
+
+# PGRST000-003: PostgREST sin conexión / pool de Postgres agotado (503/504).
+# APIError sin `code` = body del gateway: sólo throttling / 5xx upstream son transitorios
+# (un "Invalid API key" también viene sin code y no tiene que reintentar ni abrir el breaker).
+# Body no-JSON: página HTML de un 502/504 del gateway.
+_RETRY_PGRST_CODES = frozenset({"PGRST000", "PGRST001", "PGRST002", "PGRST003"})
+_TRANSIENT_GATEWAY_MARKERS = (
+    "rate limit",
+    "too many requests",
+    "upstream",
+    "timed out",
+    "timeout",
+    "unavailable",
+    "bad gateway",
+    "ring-balancer",
+)
+_PGREST_READ_RETRY_EXC = (httpx.TransportError, APIError, json.JSONDecodeError)
+
+
+def _is_transient_pgrest_error(exc: BaseException) -> bool:
+    if isinstance(exc, APIError):
+        if exc.code is not None:
+            return exc.code in _RETRY_PGRST_CODES
+        text = f"{exc.message or ''} {exc.details or ''}".lower()
+        return any(marker in text for marker in _TRANSIENT_GATEWAY_MARKERS)
+    return isinstance(exc, (httpx.TransportError, json.JSONDecodeError))
+
+
+def _execute(query, read: bool = True):
+    # lecturas / deletes de PostgREST (idempotentes); nunca usar para inserts.
+    # Sólo las lecturas (read=True) reintentan throttling / 5xx que llegan como APIError.
+    _PGREST_BREAKER.before_call()
+    try:
+        res = _with_retries(
+            query.execute,
+            retry_exc=_PGREST_READ_RETRY_EXC if read else (httpx.TransportError,),
+            retry_exc_if=_is_transient_pgrest_error,
+        )
+    except _PGREST_READ_RETRY_EXC as exc:
+        if _is_transient_pgrest_error(exc):
+            _PGREST_BREAKER.record_failure()
+        raise
+    _PGREST_BREAKER.record_success()
+    return res
+
+
+async def _aexecute(query):
+    # igual que _execute (breaker + reintentos) para queries del cliente async
+    _PGREST_BREAKER.before_call()
+    attempts = max(1, HTTP_RETRY_ATTEMPTS)
+    for attempt in range(attempts):
+        try:
+            res = await query.execute()
+        except _PGREST_READ_RETRY_EXC as exc:
+            if not _is_transient_pgrest_error(exc):
+                raise
+            if attempt == attempts - 1:
+                _PGREST_BREAKER.record_failure()
+                raise
+            await asyncio.sleep(random.uniform(0, min(5.0, 0.2 * (2 ** attempt))))
+        else:
+            _PGREST_BREAKER.record_success()
+            return res
+    raise AssertionError("unreachable")
+
+
+# -----------------------------
+# Read caches (in-process, TTL corto)
+# -----------------------------
+class _TTLStore:
+    """
+    TTLCache behind a lock: cachetools caches are not thread-safe and sync
+    routes run concurrently in the threadpool.
+    """
+
+    def __init__(self, ttl_seconds: float, maxsize: int = 10_000) -> None:
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._cache[key] = value
+
+    def pop(self, key: Any) -> None:
+        with self._lock:
+            self._cache.pop(key, None)
+
+
+_JOB_STATUS_CACHE = _TTLStore(JOB_STATUS_CACHE_TTL_MS / 1000)
+_CLUSTERS_CACHE = _TTLStore(CLUSTERS_CACHE_TTL_MS / 1000)
+
+
+# keep-alive + HTTP/2 hacia Storage: las descargas de fotos se multiplexan sobre pocas conexiones
+HTTP_CLIENT = httpx.Client(
+    http2=True,
+    timeout=HTTP_TIMEOUT_SECONDS,
+    limits=httpx.Limits(max_connections=STORAGE_FETCH_SLOTS, max_keepalive_connections=STORAGE_FETCH_SLOTS),
+)
+
+# /download no puede acaparar el pool: comparte STORAGE_FETCH_SLOTS entre todos los requests,
+# y los removes de /delete tienen su propio cupo.
+_STORAGE_FETCH_SEMA = threading.BoundedSemaphore(STORAGE_FETCH_SLOTS)
+# pool compartido para las descargas de /download (no un pool de threads por request)
+_DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=STORAGE_FETCH_SLOTS, thread_name_prefix="zip-fetch")
+_STORAGE_DELETE_SEMA = threading.BoundedSemaphore(STORAGE_DELETE_SLOTS)
 
 
 def _public_uploads_url(path: str) -> Optional[str]:
-    base = os.getenv("SUPABASE_URL", "").rstrip("/")
-    if not base or not path:
+    if not PUBLIC_UPLOADS_PREFIX or not path:
         return None
-    return f"{base}/storage/v1/object/public/{UPLOADS_BUCKET}/{path.lstrip('/')}"
+    return PUBLIC_UPLOADS_PREFIX + path.lstrip("/")
+
+
+def _storage_object_url(path: str) -> str:
+    if not SUPABASE_URL:
+        raise RuntimeError("Missing Supabase envs")
+    return f"{SUPABASE_URL}/storage/v1/object/{UPLOADS_BUCKET}/{path.lstrip('/')}"
+
+
+def _storage_headers(content_type: str) -> Dict[str, str]:
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        raise RuntimeError("Missing Supabase envs")
+    return {
+        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+        "apikey": SUPABASE_SERVICE_ROLE_KEY,
+        "Content-Type": content_type,
+        "x-upsert": "false",
+    }
 
 
 # -----------------------------
@@ -102,11 +503,18 @@ def _normalize_code(code: str) -> str:
     return (code or "").strip().upper().replace(" ", "").replace("_", "-")
 
 
+_CODE_SALT_PREFIX = (ALBUM_CODE_SALT + ":").encode("utf-8")
+
+
+@lru_cache(maxsize=1024)
+def _hash_normalized_code(c: str) -> str:
+    # los endpoints que se pollean repiten siempre el mismo código
+    return hashlib.sha256(_CODE_SALT_PREFIX + c.encode("utf-8")).hexdigest()
+
+
 def _hash_code(code: str) -> str:
     _require_code_salt()
-    c = _normalize_code(code)
-    data = (ALBUM_CODE_SALT + ":" + c).encode("utf-8")
-    return hashlib.sha256(data).hexdigest()
+    return _hash_normalized_code(_normalize_code(code))
 
 
 def _hint_from_code(code: str) -> str:
@@ -116,6 +524,33 @@ def _hint_from_code(code: str) -> str:
     return clean[-4:] if len(clean) >= 4 else clean
 
 
+# clave propia para tokens (derivada del salt, distinta del hash de códigos)
+_ALBUM_TOKEN_KEY = hmac.new(ALBUM_CODE_SALT.encode("utf-8"), b"album-token", hashlib.sha256).digest()
+
+
+def _sign_album_token(album_id: str, exp: int) -> str:
+    return hmac.new(_ALBUM_TOKEN_KEY, f"{album_id}:{exp}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _issue_album_token(album_id: str) -> str:
+    exp = int(time.time()) + ALBUM_TOKEN_TTL_SECONDS
+    return f"{exp}.{_sign_album_token(album_id, exp)}"
+
+
+def _check_album_token(album_id: str, token: Optional[str]) -> bool:
+    """Validates an X-Album-Token locally (HMAC + expiry), without touching the DB."""
+    if not token or not ALBUM_CODE_SALT:
+        return False
+    exp_raw, _, sig = token.partition(".")
+    # isdigit() solo acepta también dígitos unicode ("²") y largos que int() rechaza
+    if not (exp_raw.isascii() and exp_raw.isdigit() and len(exp_raw) <= 12):
+        return False
+    exp = int(exp_raw)
+    if exp < time.time():
+        return False
+    return hmac.compare_digest(sig.encode("utf-8"), _sign_album_token(album_id, exp).encode("utf-8"))
+
+
 def _get_album_code_or_403(x_album_code: Optional[str], code_qs: Optional[str]) -> str:
     code = x_album_code or code_qs
     if not code:
@@ -128,18 +563,24 @@ def _require_album_access(
     album_id: str,
     x_album_code: Optional[str],
     code_qs: Optional[str],
+    x_album_token: Optional[str] = None,
+    response: Optional[Response] = None,
 ) -> None:
     """
     Enforces recovery code if album has access_code_hash set.
     Backward compatible: if column is null/empty, allow.
+    A valid X-Album-Token skips the check; after a successful check a fresh
+    token is set on `response` (if given).
     """
+    if _check_album_token(album_id, x_album_token):
+        return
+
     # read hash from album
-    res = (
+    res = _execute(
         sb.table("albums")
         .select("id,access_code_hash,access_code_hint")
         .eq("id", album_id)
         .limit(1)
-        .execute()
     )
     if getattr(res, "error", None):
         raise HTTPException(status_code=500, detail="albums read failed")
@@ -150,6 +591,7 @@ def _require_album_access(
     stored_hash = (row.get("access_code_hash") or "").strip()
     if not stored_hash:
         # no auth configured => allow (backward compat)
+        _attach_album_token(response, album_id)
         return
 
     # validate provided code
@@ -160,32 +602,54 @@ def _require_album_access(
         # salt missing => treat as server misconfig
         raise HTTPException(status_code=500, detail="Server misconfigured (missing ALBUM_CODE_SALT)")
 
-    if provided_hash != stored_hash:
+    if not hmac.compare_digest(provided_hash, stored_hash):
         hint = row.get("access_code_hint")
         if hint:
             raise HTTPException(status_code=403, detail=f"Invalid album code (hint: ****{hint})")
         raise HTTPException(status_code=403, detail="Invalid album code")
 
+    _attach_album_token(response, album_id)
+
+
+def _attach_album_token(response: Optional[Response], album_id: str) -> None:
+    if response is not None and ALBUM_CODE_SALT:
+        response.headers["X-Album-Token"] = _issue_album_token(album_id)
+
 
 # -----------------------------
 # Models
 # -----------------------------
 class ProcessRequest(BaseModel):
+    # payload inmutable y chico: sin validate_assignment ni copias defensivas
+    model_config = ConfigDict(frozen=True, revalidate_instances="never")
+
     fingerprint: str
     uploadKey: Optional[str] = None
+    # devuelto por /upload y /upload-confirm; sin él /process valida el ZIP en Storage
+    uploadToken: Optional[str] = None
+
+
+class UploadConfirmRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, revalidate_instances="never")
+
+    uploadKey: str
 
 
 # -----------------------------
 # Routes
 # -----------------------------
+# body fijo para probes del load balancer: sin serializar nada por request
+_OK_BODY = b'{"ok":true}'
+
+
 @app.get("/")
 def root():
-    return {"ok": True}
+    return Response(content=_OK_BODY, media_type="application/json")
 
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    return Response(content=_OK_BODY, media_type="application/json")
 
 
 @app.get("/__version")
@@ -197,6 +661,7 @@ def version():
         "limits": {
             "maxZipMB": MAX_ZIP_MB,
             "maxPhotosPerAlbum": MAX_PHOTOS_PER_ALBUM,
+            "maxPhotoMB": MAX_PHOTO_MB,
         },
         "recoveryCode": {
             "enabled": True,
@@ -209,44 +674,280 @@ def version():
 # -----------------------------
 # ZIP helpers (API-side validation)
 # -----------------------------
-def _count_images_in_zip(zip_bytes: bytes) -> int:
+_IMG_EXTS = frozenset({"jpg", "jpeg", "png"})
+_ZIP_MAGIC = b"PK\x03\x04"  # local file header de la primera entrada
+
+
+def _count_images_in_zip(fileobj: BinaryIO) -> int:
+    # zipfile only seeks to the central directory at the end of the archive,
+    # so counting entries never pulls the whole upload into memory.
     try:
-        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
+        zf = zipfile.ZipFile(fileobj)
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid ZIP file")
 
+    max_photo_bytes = MAX_PHOTO_MB * 1024 * 1024
     count = 0
-    for name in zf.namelist():
-        n = name.lower()
-        if n.endswith("/") or not (n.endswith(".jpg") or n.endswith(".jpeg") or n.endswith(".png")):
-            continue
-        count += 1
-        if count > MAX_PHOTOS_PER_ALBUM:
-            break
+    with zf:
+        for info in zf.infolist():
+            if info.is_dir() or info.file_size == 0:
+                continue
+            name = info.filename
+            # resource forks de macOS (__MACOSX/, ._foto.jpg) y archivos ocultos no son fotos
+            if name.startswith("__MACOSX/") or name.rpartition("/")[2].startswith("."):
+                continue
+            _, dot, ext = name.rpartition(".")
+            if not dot or ext.lower() not in _IMG_EXTS:
+                continue
+            # file_size = tamaño descomprimido declarado en el central directory
+            if info.file_size > max_photo_bytes:
+                raise HTTPException(status_code=413, detail=f"Photo too large in ZIP. Max {MAX_PHOTO_MB}MB per photo")
+            count += 1
+            if count > MAX_PHOTOS_PER_ALBUM:
+                # ya sabemos que excede el límite: no hace falta mirar el resto
+                break
     return count
 
 
+class _HTTPRangeFile:
+    """
+    Read-only, seekable view of a remote object backed by HTTP Range requests.
+    Enough for zipfile to parse the central directory (EOCD at the tail) without
+    downloading the archive; reads are served from 64 KiB blocks.
+    """
+
+    _BLOCK = 64 * 1024
+
+    def __init__(self, url: str, size: int) -> None:
+        self._url = url
+        self._size = size
+        self._pos = 0
+        self._buf_start = 0
+        self._buf = b""
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._pos = max(0, min(offset, self._size))
+        return self._pos
+
+    def read(self, n: int = -1) -> bytes:
+        end = self._size if n is None or n < 0 else min(self._pos + n, self._size)
+        if end <= self._pos:
+            return b""
+        buf_end = self._buf_start + len(self._buf)
+        if not (self._buf_start <= self._pos and end <= buf_end):
+            start = self._pos
+            stop = min(max(end, start + self._BLOCK), self._size)
+            try:
+                r = HTTP_CLIENT.get(self._url, headers={"Range": f"bytes={start}-{stop - 1}"})
+            except httpx.HTTPError as e:
+                raise HTTPException(status_code=500, detail=f"Upload check failed: {e}")
+            if r.status_code != 206:
+                raise HTTPException(status_code=500, detail=f"Upload check failed ({r.status_code})")
+            self._buf_start, self._buf = start, r.content
+        data = self._buf[self._pos - self._buf_start:end - self._buf_start]
+        self._pos += len(data)
+        return data
+
+
+def _is_upload_key(key: str) -> bool:
+    # sólo aceptamos keys emitidas por /upload-request (zips/<uuid hex>.zip)
+    name = key[len("zips/"):-len(".zip")]
+    return (
+        key.startswith("zips/")
+        and key.endswith(".zip")
+        and len(name) == 32
+        and all(c in string.hexdigits for c in name)
+    )
+
+
+# confirmación firmada de un ZIP ya validado (misma idea que X-Album-Token, clave propia)
+_UPLOAD_TOKEN_KEY = hmac.new(ALBUM_CODE_SALT.encode("utf-8"), b"upload-confirm", hashlib.sha256).digest()
+
+
+def _sign_upload_key(object_path: str) -> Optional[str]:
+    if not ALBUM_CODE_SALT:
+        return None
+    return hmac.new(_UPLOAD_TOKEN_KEY, object_path.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _check_upload_token(object_path: str, token: Optional[str]) -> bool:
+    expected = _sign_upload_key(object_path)
+    if not token or not expected:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))
+
+
+def _validate_uploaded_zip(object_path: str) -> None:
+    """
+    Applies the /upload guards (size, image count, per-photo size) to a ZIP that
+    is already in Storage, reading only its central directory via Range
+    requests. ZIPs rejected with 400/413 are removed from Storage.
+    """
+    url = _public_uploads_url(object_path)
+    if not url:
+        raise HTTPException(status_code=500, detail="Missing SUPABASE_URL")
+
+    try:
+        head = HTTP_CLIENT.head(url)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Upload check failed: {e}")
+    if head.status_code in (400, 404):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if head.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"Upload check failed ({head.status_code})")
+
+    size = int(head.headers.get("content-length") or 0)
+    try:
+        # mismos guards que /upload
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty file")
+        if size > MAX_ZIP_MB * 1024 * 1024:
+            raise HTTPException(status_code=413, detail=f"ZIP too large. Max {MAX_ZIP_MB}MB")
+
+        img_count = _count_images_in_zip(_HTTPRangeFile(url, size))
+        if img_count == 0:
+            raise HTTPException(status_code=400, detail="ZIP contains no supported images (.jpg/.jpeg/.png)")
+        if img_count > MAX_PHOTOS_PER_ALBUM:
+            raise HTTPException(status_code=413, detail=f"Too many photos in ZIP. Max {MAX_PHOTOS_PER_ALBUM}")
+    except HTTPException as e:
+        if e.status_code in (400, 413):
+            _remove_upload(object_path)
+        raise
+
+
+def _remove_upload(object_path: str) -> None:
+    try:
+        _bulkhead_remove(supabase_admin().storage.from_(UPLOADS_BUCKET), [object_path])
+    except Exception:
+        logger.warning("could not remove rejected upload %s", object_path)
+
+
+def _parse_storage_ts(value: Any) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+_SWEEP_PAGE = 1000
+
+
+def _sweep_unconfirmed_uploads() -> int:
+    """
+    Removes zips/ objects that no album references and whose age falls in
+    [UNCONFIRMED_UPLOAD_TTL_SECONDS, + UPLOAD_SWEEP_WINDOW_SECONDS): signed
+    uploads that were never confirmed/processed (and abandoned /upload ZIPs).
+    Only the window is examined, so a run costs the uploads of the last TTL +
+    window rather than the whole bucket history. Returns how many were removed.
+    """
+    sb = supabase_admin()
+    bucket = sb.storage.from_(UPLOADS_BUCKET)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=UNCONFIRMED_UPLOAD_TTL_SECONDS)
+    window_start = cutoff - timedelta(seconds=UPLOAD_SWEEP_WINDOW_SECONDS)
+
+    # listado del más nuevo al más viejo: salteamos los que aún están dentro del TTL
+    # y cortamos en el primer objeto anterior a la ventana
+    stale: List[str] = []
+    offset = 0
+    done = False
+    while not done:
+        page = bucket.list(
+            "zips",
+            {"limit": _SWEEP_PAGE, "offset": offset, "sortBy": {"column": "created_at", "order": "desc"}},
+        ) or []
+        offset += len(page)
+        done = len(page) < _SWEEP_PAGE
+        for obj in page:
+            created = _parse_storage_ts(obj.get("created_at"))
+            if created is None or created >= cutoff:
+                continue
+            if created < window_start:
+                done = True
+                break
+            path = f"zips/{obj.get('name')}"
+            if _is_upload_key(path):
+                stale.append(path)
+
+    if not stale:
+        return 0
+
+    # los ZIPs que ya tienen álbum (confirmados + /process) no se tocan
+    referenced = set()
+    for batch in _chunked(stale, PGREST_IN_BATCH):
+        res = _execute(sb.table("albums").select("upload_key").in_("upload_key", batch))
+        referenced.update(r.get("upload_key") for r in (res.data or []))
+
+    orphans = [p for p in stale if p not in referenced]
+    for batch in _chunked(orphans, STORAGE_REMOVE_BATCH):
+        _bulkhead_remove(bucket, batch)
+    return len(orphans)
+
+
+async def _upload_sweeper() -> None:
+    # desfase aleatorio: con varios workers no barren todos a la vez (los removes son idempotentes)
+    await asyncio.sleep(random.uniform(0, UPLOAD_SWEEP_SECONDS))
+    while True:
+        try:
+            removed = await run_in_threadpool(_sweep_unconfirmed_uploads)
+            if removed:
+                logger.info("removed %d unconfirmed uploads", removed)
+        except Exception:
+            logger.exception("upload sweep failed")
+        await asyncio.sleep(UPLOAD_SWEEP_SECONDS)
+
+
+async def _iter_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+    await file.seek(0)
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        yield chunk
+
+
 # -----------------------------
 # Upload ZIP
 # -----------------------------
 @app.post("/upload")
 async def upload_zip(file: UploadFile = File(...)):
-    sb = supabase_admin()
-
-    if not file.filename.lower().endswith(".zip"):
+    # filename puede venir vacío/None en multipart; sólo miramos el sufijo
+    if (file.filename or "")[-4:].lower() != ".zip":
         raise HTTPException(status_code=400, detail="Only .zip supported")
 
-    content = await file.read()
-    if not content:
+    # Starlette ya dejó el upload en un SpooledTemporaryFile: validamos sobre
+    # el handle en vez de materializar el ZIP completo en RAM.
+    src = file.file
+    src.seek(0, os.SEEK_END)
+    size = src.tell()
+    src.seek(0)
+    if not size:
         raise HTTPException(status_code=400, detail="Empty file")
 
+    # magic bytes: un .zip renombrado se rechaza sin parsear el central directory
+    if src.read(4) != _ZIP_MAGIC:
+        raise HTTPException(status_code=400, detail="Invalid ZIP file")
+    src.seek(0)
+
     # Guard 1: tamaño ZIP
     max_bytes = MAX_ZIP_MB * 1024 * 1024
-    if len(content) > max_bytes:
+    if size > max_bytes:
         raise HTTPException(status_code=413, detail=f"ZIP too large. Max {MAX_ZIP_MB}MB")
 
     # Guard 2: cantidad de fotos dentro del ZIP
-    img_count = _count_images_in_zip(content)
+    # parsear el central directory es I/O de disco + CPU: fuera del event loop
+    img_count = await run_in_threadpool(_count_images_in_zip, src)
     if img_count == 0:
         raise HTTPException(status_code=400, detail="ZIP contains no supported images (.jpg/.jpeg/.png)")
     if img_count > MAX_PHOTOS_PER_ALBUM:
@@ -254,17 +955,96 @@ async def upload_zip(file: UploadFile = File(...)):
 
     object_path = f"zips/{uuid4().hex}.zip"
 
-    res = sb.storage.from_(UPLOADS_BUCKET).upload(
-        path=object_path,
-        file=content,
-        file_options={"content-type": "application/zip"},
-    )
+    # Streaming directo a Storage (REST), chunk a chunk desde el spool:
+    # el ZIP nunca se materializa entero en RAM.
+    url = _storage_object_url(object_path)
+    headers = _storage_headers("application/zip")
+    headers["Content-Length"] = str(size)
+
+    try:
+        res = await app.state.http.post(url, content=_iter_upload_file(file), headers=headers)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
+
+    if res.status_code not in (200, 201):
+        raise HTTPException(status_code=500, detail=f"Upload failed: {res.text}")
+
+    # mantenemos tu contrato de respuesta (+ uploadToken: /process no re-valida)
+    return {"uploadKey": object_path, "fingerprint": object_path, "uploadToken": _sign_upload_key(object_path)}
+
+
+# -----------------------------
+# Upload directo browser -> Storage (URL firmada); la API no toca los bytes
+# -----------------------------
+async def _uploads_bucket_size_limited(client: httpx.AsyncClient) -> bool:
+    """
+    True if the uploads bucket has a file_size_limit no larger than MAX_ZIP_MB
+    (set by supabase/migrations/*_uploads_bucket_file_size_limit.sql). Signed
+    upload URLs carry no size limit of their own, so without it Storage would
+    accept arbitrarily large objects.
+    """
+    url = f"{SUPABASE_URL}/storage/v1/bucket/{UPLOADS_BUCKET}"
+    try:
+        res = await client.get(url, headers=_storage_headers("application/json"))
+        limit = res.json().get("file_size_limit") if res.status_code == 200 else None
+    except (httpx.HTTPError, ValueError):
+        limit = None
+    if not isinstance(limit, int) or limit <= 0 or limit > MAX_ZIP_MB * 1024 * 1024:
+        logger.warning(
+            "bucket %s has no file_size_limit <= %dMB (got %r): /upload-request disabled",
+            UPLOADS_BUCKET, MAX_ZIP_MB, limit,
+        )
+        return False
+    return True
+
+
+@app.post("/upload-request")
+def upload_request(request: Request):
+    """
+    Issues a signed upload URL for a fresh object path. The client PUTs the ZIP
+    straight to Storage and then calls /upload-confirm with the same uploadKey.
+    The signed URL itself carries no size limit: Storage enforces maxBytes via
+    the bucket's file_size_limit, checked at startup (503 here if missing).
+    The ZIP guards run in /upload-confirm (or /process without its
+    uploadToken), and keys never confirmed are removed by the upload sweeper.
+    """
+    if not SUPABASE_URL:
+        raise HTTPException(status_code=500, detail="Missing SUPABASE_URL")
+    if not getattr(request.app.state, "signed_uploads_enabled", False):
+        raise HTTPException(status_code=503, detail="Direct uploads unavailable; use /upload")
+
+    object_path = f"zips/{uuid4().hex}.zip"
+    sign_url = f"{SUPABASE_URL}/storage/v1/object/upload/sign/{UPLOADS_BUCKET}/{object_path}"
+    try:
+        res = HTTP_CLIENT.post(sign_url, headers=_storage_headers("application/json"))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Upload request failed: {e}")
+    if res.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"Upload request failed: {res.text}")
+
+    # Storage devuelve una ruta relativa: /object/upload/sign/<bucket>/<path>?token=...
+    signed = res.json().get("url") or ""
+    return {
+        "uploadUrl": f"{SUPABASE_URL}/storage/v1{signed}",
+        "uploadKey": object_path,
+        "maxBytes": MAX_ZIP_MB * 1024 * 1024,
+    }
 
-    if getattr(res, "error", None):
-        raise HTTPException(status_code=500, detail=f"Upload failed: {res.error}")
 
-    # mantenemos tu contrato de respuesta
-    return {"uploadKey": object_path, "fingerprint": object_path}
+@app.post("/upload-confirm")
+def upload_confirm(payload: UploadConfirmRequest):
+    """
+    Validates a ZIP uploaded through /upload-request with the same guards as
+    /upload and returns a signed uploadToken that /process accepts in place of
+    re-validating the ZIP. Rejected uploads are removed from Storage.
+    """
+    object_path = payload.uploadKey
+    if not _is_upload_key(object_path):
+        raise HTTPException(status_code=400, detail="Invalid uploadKey")
+
+    _validate_uploaded_zip(object_path)
+
+    return {"uploadKey": object_path, "fingerprint": object_path, "uploadToken": _sign_upload_key(object_path)}
 
 
 # -----------------------------
@@ -280,14 +1060,20 @@ def process_album(payload: ProcessRequest):
     fingerprint = payload.fingerprint.strip()
     upload_key = payload.uploadKey.strip()
 
+    # sólo ZIPs emitidos por /upload o /upload-request, y validados: si no viene la
+    # confirmación firmada (cliente viejo o se salteó /upload-confirm) validamos acá
+    if not _is_upload_key(upload_key):
+        raise HTTPException(status_code=400, detail="Invalid uploadKey")
+    if not _check_upload_token(upload_key, payload.uploadToken):
+        _validate_uploaded_zip(upload_key)
+
     # 1️⃣ Buscar album existente reutilizable
-    existing = (
+    existing = _execute(
         sb.table("albums")
-        .select("id,status,access_code_hash")
+        .select("id,status")
         .eq("fingerprint", fingerprint)
         .order("created_at", desc=True)
         .limit(1)
-        .execute()
     )
 
     album_id = None
@@ -326,42 +1112,42 @@ def process_album(payload: ProcessRequest):
             "upload_key": upload_key,
             "error_message": None,
         }
-        # only set if columns exist + salt configured
+        # columnas de supabase/migrations/*_albums_access_code_columns.sql; sólo con salt configurado
         if code_hash:
             insert_payload["access_code_hash"] = code_hash
             insert_payload["access_code_hint"] = code_hint
             insert_payload["access_code_created_at"] = code_created_at
 
-        res = sb.table("albums").insert(insert_payload).execute()
+        # necesitamos el id generado => representation
+        res = sb.table("albums").insert(insert_payload, returning=ReturnMethod.representation).execute()
 
         if getattr(res, "error", None) or not res.data:
             raise HTTPException(status_code=500, detail="Album insert failed")
 
         album_id = res.data[0]["id"]
 
-    # 3️⃣ Verificar si ya hay job activo
-    job_check = (
-        sb.table("jobs")
-        .select("id,status")
-        .eq("album_id", album_id)
-        .in_("status", ["pending", "processing"])
-        .order("created_at", desc=True)
-        .limit(1)
-        .execute()
-    )
+    _JOB_STATUS_CACHE.pop(album_id)
+
+    # 3️⃣ Verificar si ya hay job activo (solo un album reusado puede tenerlo;
+    # un album recién insertado no tiene jobs => nos ahorramos el round-trip)
+    if reused:
+        job_check = _execute(
+            sb.table("jobs")
+            .select("id")
+            .eq("album_id", album_id)
+            .in_("status", ["pending", "processing"])
+            .order("created_at", desc=True)
+            .limit(1)
+        )
 
-    if getattr(job_check, "error", None):
-        raise HTTPException(status_code=500, detail="Jobs read failed")
+        if getattr(job_check, "error", None):
+            raise HTTPException(status_code=500, detail="Jobs read failed")
 
-    if job_check.data:
-        job_id = job_check.data[0]["id"]
-        # IMPORTANT: never re-issue recoveryCode for reused albums
-        resp = {"albumId": album_id, "jobId": job_id}
-        if recovery_code and not reused:
-            resp["recoveryCode"] = recovery_code
-        return resp
+        if job_check.data:
+            # IMPORTANT: never re-issue recoveryCode for reused albums
+            return {"albumId": album_id, "jobId": job_check.data[0]["id"]}
 
-    # 4️⃣ Crear job nuevo
+    # 4️⃣ Crear job nuevo (id generado acá => no hace falta que PostgREST devuelva la fila)
     job_id = str(uuid4())
 
     job_res = sb.table("jobs").insert(
@@ -372,7 +1158,8 @@ def process_album(payload: ProcessRequest):
             "zip_path": upload_key,
             "error": None,
             "result": None,
-        }
+        },
+        returning=ReturnMethod.minimal,
     ).execute()
 
     if getattr(job_res, "error", None):
@@ -388,15 +1175,37 @@ def process_album(payload: ProcessRequest):
 # JOB STATUS (lee albums)
 # NOTE: lo dejamos sin auth para que el polling funcione sin fricción.
 # -----------------------------
+def _job_etag(resp: Dict[str, Any]) -> str:
+    key = f"{resp['status']}|{resp['progress']}|{resp['photoCount']}|{resp['errorMessage']}"
+    return '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest() + '"'
+
+
 @app.get("/jobs/{album_id}")
-def get_job(album_id: str):
-    sb = supabase_admin()
+async def get_job(album_id: str, request: Request, response: Response):
+    resp = _JOB_STATUS_CACHE.get(album_id)
+    if resp is None:
+        resp = await _read_job_status(album_id)
+        _JOB_STATUS_CACHE.set(album_id, resp)
+
+    # polling: si el estado no cambió respondemos 304 sin body
+    etag = _job_etag(resp)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return resp
 
-    res = (
-        sb.table("albums")
+
+async def _read_job_status(album_id: str) -> Dict[str, Any]:
+    pg: Optional[AsyncPostgrestClient] = app.state.pg
+    if pg is None:
+        raise RuntimeError("Missing Supabase envs")
+
+    res = await _aexecute(
+        pg.from_("albums")
         .select("id,status,progress,error_message,photo_count")
         .eq("id", album_id)
-        .execute()
+        .limit(1)
     )
 
     if getattr(res, "error", None):
@@ -427,24 +1236,32 @@ def get_job(album_id: str):
 @app.get("/albums/{album_id}/clusters")
 def list_clusters(
     album_id: str,
+    response: Response,
     x_album_code: Optional[str] = Header(default=None, alias="X-Album-Code"),
+    x_album_token: Optional[str] = Header(default=None, alias="X-Album-Token"),
     code: Optional[str] = Query(default=None, alias="code"),
 ):
     sb = supabase_admin()
-    _require_album_access(sb, album_id, x_album_code, code)
+    _require_album_access(sb, album_id, x_album_code, code, x_album_token, response)
 
-    res = (
+    # cache después del check de acceso: nunca sirve clusters sin código válido
+    cached = _CLUSTERS_CACHE.get(album_id)
+    if cached is not None:
+        return cached
+
+    res = _execute(
         sb.table("face_clusters")
         .select("id,thumbnail_url,created_at")
         .eq("album_id", album_id)
         .order("created_at", desc=False)
-        .execute()
     )
 
     if getattr(res, "error", None):
         raise HTTPException(status_code=500, detail="Clusters read failed")
 
-    return {"albumId": album_id, "clusters": res.data or []}
+    resp = {"albumId": album_id, "clusters": res.data or []}
+    _CLUSTERS_CACHE.set(album_id, resp)
+    return resp
 
 
 # -----------------------------
@@ -453,39 +1270,30 @@ def list_clusters(
 @app.get("/albums/{album_id}/photos")
 def list_photos_for_cluster(
     album_id: str,
+    response: Response,
     clusterId: str = Query(..., alias="clusterId"),
     x_album_code: Optional[str] = Header(default=None, alias="X-Album-Code"),
+    x_album_token: Optional[str] = Header(default=None, alias="X-Album-Token"),
     code: Optional[str] = Query(default=None, alias="code"),
 ):
     sb = supabase_admin()
-    _require_album_access(sb, album_id, x_album_code, code)
-
-    links = (
-        sb.table("photo_faces")
-        .select("photo_id")
-        .eq("cluster_id", clusterId)
-        .execute()
-    )
-
-    if getattr(links, "error", None):
-        raise HTTPException(status_code=500, detail="photo_faces read failed")
-
-    photo_ids = [x["photo_id"] for x in (links.data or []) if x.get("photo_id")]
 
-    if not photo_ids:
-        return {"albumId": album_id, "clusterId": clusterId, "photos": []}
+    _require_album_access(sb, album_id, x_album_code, code, x_album_token, response)
 
-    photos_res = (
+    # join photos ⨝ photo_faces resuelto por PostgREST (!inner) => un solo round-trip
+    photos_res = _execute(
         sb.table("photos")
-        .select("id,storage_path,created_at")
-        .in_("id", photo_ids)
+        .select("id,storage_path,created_at,photo_faces!inner(cluster_id)")
+        # clusterId viene del cliente: acotar al álbum cuyo acceso se validó
+        .eq("album_id", album_id)
+        .eq("photo_faces.cluster_id", clusterId)
         .order("created_at", desc=False)
-        .execute()
     )
 
     if getattr(photos_res, "error", None):
         raise HTTPException(status_code=500, detail="photos read failed")
 
+    prefix = PUBLIC_UPLOADS_PREFIX
     photos = []
     for p in (photos_res.data or []):
         sp = p.get("storage_path")
@@ -493,7 +1301,7 @@ def list_photos_for_cluster(
             {
                 "id": p.get("id"),
                 "storagePath": sp,
-                "url": _public_uploads_url(sp) if sp else None,
+                "url": prefix + sp.lstrip("/") if (prefix and sp) else None,
                 "createdAt": p.get("created_at"),
             }
         )
@@ -504,70 +1312,212 @@ def list_photos_for_cluster(
 # -----------------------------
 # DOWNLOAD ZIP POR CLUSTER (protected)
 # -----------------------------
-@app.get("/albums/{album_id}/download")
-def download_cluster(
+def _chunked(items: List[T], size: int) -> Iterator[List[T]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _bulkhead_get(url: str) -> httpx.Response:
+    # el slot se toma por intento: el backoff entre reintentos no retiene cupo
+    with _STORAGE_FETCH_SEMA:
+        return HTTP_CLIENT.get(url)
+
+
+def _bulkhead_remove(bucket, paths: List[str]):
+    with _STORAGE_DELETE_SEMA:
+        return bucket.remove(paths)
+
+
+def _fetch_photo(storage_path: str) -> Optional[bytes]:
+    url = PUBLIC_UPLOADS_PREFIX + storage_path.lstrip("/")
+    _STORAGE_BREAKER.before_call()
+    try:
+        r = _with_retries(
+            lambda: _bulkhead_get(url),
+            retry_exc=(httpx.TransportError,),
+            retry_if=lambda resp: resp.status_code in _RETRY_STATUS,
+        )
+    except httpx.TransportError:
+        _STORAGE_BREAKER.record_failure()
+        raise
+    if r.status_code in _RETRY_STATUS or r.status_code >= 500:
+        _STORAGE_BREAKER.record_failure()
+    else:
+        _STORAGE_BREAKER.record_success()
+    if r.status_code != 200:
+        return None
+    return r.content
+
+
+class _ZipStreamWriter:
+    """
+    Write-only sink for zipfile: exposes tell() but not seek(), so ZipFile
+    writes data descriptors and never rewinds. Bytes are drained per entry.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+        self._offset = 0
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._offset += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _iter_cluster_zip(items: List[Dict[str, Any]]) -> Iterator[bytes]:
+    """
+    Yields the ZIP one entry at a time. At most DOWNLOAD_CONCURRENCY photos are
+    in flight: the next fetch is submitted only as one is consumed, so memory
+    follows the window (not the cluster) and a slow client throttles fetching.
+    Raises 404 before the first yield if no photo could be fetched, so the
+    route can still answer with an error.
+    """
+    out = _ZipStreamWriter()
+    written = 0
+    pending_items = (p for p in items if p.get("storage_path"))
+    in_flight: Dict[Future, Dict[str, Any]] = {}
+
+    def submit_next() -> None:
+        p = next(pending_items, None)
+        if p is not None:
+            in_flight[_DOWNLOAD_POOL.submit(_fetch_photo, p["storage_path"])] = p
+
+    try:
+        for _ in range(max(1, DOWNLOAD_CONCURRENCY)):
+            submit_next()
+        # JPEG/PNG ya vienen comprimidos: STORED evita quemar CPU en zlib por ~0% de ganancia
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                while done:
+                    # el future sale del dict (y de `done`) antes de escribir: sus bytes no quedan retenidos
+                    fut = done.pop()
+                    p = in_flight.pop(fut)
+                    content = fut.result()
+                    del fut
+                    submit_next()
+                    if content is None:
+                        continue
+                    ext = os.path.splitext(p["storage_path"])[1] or ".jpg"
+                    compress_type = zipfile.ZIP_STORED if ext[1:].lower() in _IMG_EXTS else zipfile.ZIP_DEFLATED
+                    zf.writestr(f"{p.get('id')}{ext}", content, compress_type=compress_type)
+                    del content
+                    written += 1
+                    yield out.drain()
+            if not written:
+                raise HTTPException(status_code=404, detail="Could not build ZIP")
+        # central directory
+        yield out.drain()
+    finally:
+        # si el cliente corta la descarga no seguimos bajando fotos
+        for fut in in_flight:
+            fut.cancel()
+
+
+@app.get("/albums/{album_id}/download-manifest")
+def download_manifest(
     album_id: str,
+    response: Response,
     clusterId: str = Query(..., alias="clusterId"),
     x_album_code: Optional[str] = Header(default=None, alias="X-Album-Code"),
+    x_album_token: Optional[str] = Header(default=None, alias="X-Album-Token"),
     code: Optional[str] = Query(default=None, alias="code"),
 ):
-    sb = supabase_admin()
-    _require_album_access(sb, album_id, x_album_code, code)
+    """
+    Lists the cluster's photos with their direct Storage URLs so the client can
+    fetch them in parallel (and zip them locally) without proxying bytes here.
+    """
+    if not PUBLIC_UPLOADS_PREFIX:
+        raise HTTPException(status_code=500, detail="Missing SUPABASE_URL")
 
-    links = (
-        sb.table("photo_faces")
-        .select("photo_id")
-        .eq("cluster_id", clusterId)
-        .execute()
+    sb = supabase_admin()
+    _require_album_access(sb, album_id, x_album_code, code, x_album_token, response)
+    photos_res = _execute(
+        sb.table("photos")
+        .select("id,storage_path,photo_faces!inner(cluster_id)")
+        .eq("album_id", album_id)
+        .eq("photo_faces.cluster_id", clusterId)
     )
-    if getattr(links, "error", None):
-        raise HTTPException(status_code=500, detail="photo_faces read failed")
+    if getattr(photos_res, "error", None):
+        raise HTTPException(status_code=500, detail="photos read failed")
+
+    photos = []
+    for p in (photos_res.data or []):
+        sp = p.get("storage_path")
+        if not sp:
+            continue
+        ext = os.path.splitext(sp)[1] or ".jpg"
+        photos.append(
+            {
+                "id": p.get("id"),
+                # mismo nombre que usa el ZIP de /download
+                "filename": f"{p.get('id')}{ext}",
+                "url": PUBLIC_UPLOADS_PREFIX + sp.lstrip("/"),
+            }
+        )
 
-    photo_ids = [x["photo_id"] for x in (links.data or []) if x.get("photo_id")]
-    if not photo_ids:
+    if not photos:
         raise HTTPException(status_code=404, detail="No photos for cluster")
 
-    photos_res = (
+    return {
+        "albumId": album_id,
+        "clusterId": clusterId,
+        "zipName": f"findme_{album_id}_{clusterId}.zip",
+        "photos": photos,
+    }
+
+
+# legacy: el ZIP pasa por este proceso; preferir /download-manifest
+@app.get("/albums/{album_id}/download", deprecated=True)
+def download_cluster(
+    album_id: str,
+    clusterId: str = Query(..., alias="clusterId"),
+    x_album_code: Optional[str] = Header(default=None, alias="X-Album-Code"),
+    x_album_token: Optional[str] = Header(default=None, alias="X-Album-Token"),
+    code: Optional[str] = Query(default=None, alias="code"),
+):
+    sb = supabase_admin()
+    _require_album_access(sb, album_id, x_album_code, code, x_album_token)
+    photos_res = _execute(
         sb.table("photos")
-        .select("id,storage_path")
-        .in_("id", photo_ids)
-        .execute()
+        .select("id,storage_path,photo_faces!inner(cluster_id)")
+        .eq("album_id", album_id)
+        .eq("photo_faces.cluster_id", clusterId)
+        # una fila de más alcanza para detectar el overflow (413) sin traer todo
+        .limit(MAX_PHOTOS_PER_ALBUM + 1)
     )
     if getattr(photos_res, "error", None):
         raise HTTPException(status_code=500, detail="photos read failed")
 
     items = photos_res.data or []
     if not items:
-        raise HTTPException(status_code=404, detail="No photos found")
+        raise HTTPException(status_code=404, detail="No photos for cluster")
 
     if len(items) > MAX_PHOTOS_PER_ALBUM:
         raise HTTPException(status_code=413, detail="Too many photos to download")
 
-    base = os.getenv("SUPABASE_URL", "").rstrip("/")
-    if not base:
+    if not PUBLIC_UPLOADS_PREFIX:
         raise HTTPException(status_code=500, detail="Missing SUPABASE_URL")
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for p in items:
-            sp = p.get("storage_path")
-            if not sp:
-                continue
-            url = f"{base}/storage/v1/object/public/{UPLOADS_BUCKET}/{sp.lstrip('/')}"
-            r = requests.get(url, timeout=HTTP_TIMEOUT_SECONDS)
-            if r.status_code != 200:
-                continue
-
-            ext = os.path.splitext(sp)[1] or ".jpg"
-            zf.writestr(f"{p.get('id')}{ext}", r.content)
+    # GETs en paralelo (I/O-bound); el ZIP se emite entrada por entrada.
+    # Arrancamos el generador acá para que un 404 salga antes de los headers.
+    stream = _iter_cluster_zip(items)
+    first = next(stream)
 
-    buf.seek(0)
-    data = buf.read()
-    if not data:
-        raise HTTPException(status_code=404, detail="Could not build ZIP")
-
-    return Response(
-        content=data,
+    return StreamingResponse(
+        chain([first], stream),
         media_type="application/zip",
         headers={"Content-Disposition": f'attachment; filename="findme_{album_id}_{clusterId}.zip"'},
     )
@@ -585,12 +1535,13 @@ def delete_album(
     sb = supabase_admin()
     _require_album_access(sb, album_id, x_album_code, code)
 
-    photos = (
-        sb.table("photos")
-        .select("id,storage_path")
-        .eq("album_id", album_id)
-        .execute()
-    )
+    # lecturas independientes => en paralelo (los builders se arman acá, execute() en el pool)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        photos_f = pool.submit(_execute, sb.table("photos").select("id,storage_path").eq("album_id", album_id))
+        faces_f = pool.submit(_execute, sb.table("face_embeddings").select("id").eq("album_id", album_id))
+        alb_f = pool.submit(_execute, sb.table("albums").select("upload_key").eq("id", album_id))
+        photos, faces, alb = photos_f.result(), faces_f.result(), alb_f.result()
+
     if getattr(photos, "error", None):
         raise HTTPException(status_code=500, detail="photos read failed")
 
@@ -598,12 +1549,6 @@ def delete_album(
     photo_paths = [r.get("storage_path") for r in photo_rows if r.get("storage_path")]
     photo_ids = [r.get("id") for r in photo_rows if r.get("id")]
 
-    faces = (
-        sb.table("face_embeddings")
-        .select("id")
-        .eq("album_id", album_id)
-        .execute()
-    )
     if getattr(faces, "error", None):
         raise HTTPException(status_code=500, detail="face_embeddings read failed")
 
@@ -611,35 +1556,43 @@ def delete_album(
     face_thumb_paths = [f"albums/{album_id}/faces/{r['id']}.jpg" for r in face_rows if r.get("id")]
 
     # zip original (si existe)
-    alb = sb.table("albums").select("upload_key").eq("id", album_id).execute()
     zip_paths = []
     if not getattr(alb, "error", None) and alb.data and alb.data[0].get("upload_key"):
         zip_paths = [alb.data[0]["upload_key"]]
 
-    # storage remove
-    try:
-        if photo_paths:
-            sb.storage.from_(UPLOADS_BUCKET).remove(photo_paths)
-        if face_thumb_paths:
-            sb.storage.from_(UPLOADS_BUCKET).remove(face_thumb_paths)
-        if zip_paths:
-            sb.storage.from_(UPLOADS_BUCKET).remove(zip_paths)
-    except Exception:
-        # si storage falla, seguimos con DB igual
-        pass
-
-    # DB cleanup
+    # storage remove en lotes (límite de paths por llamada), en paralelo;
+    # si storage falla, seguimos con DB igual
+    bucket = sb.storage.from_(UPLOADS_BUCKET)
+    # los tres grupos van fusionados: un álbum chico sale en una sola llamada
+    batches = list(_chunked(photo_paths + face_thumb_paths + zip_paths, STORAGE_REMOVE_BATCH))
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(len(batches), STORAGE_DELETE_SLOTS)) as pool:
+            for fut in [pool.submit(_bulkhead_remove, bucket, batch) for batch in batches]:
+                try:
+                    fut.result()
+                except Exception:
+                    pass
+
+    # DB cleanup: jobs no depende de nada => en paralelo con la cadena de fotos/caras,
+    # que sí respeta el orden de las FKs; albums al final
     try:
-        for pid in photo_ids:
-            sb.table("photo_faces").delete().eq("photo_id", pid).execute()
-
-        sb.table("face_embeddings").delete().eq("album_id", album_id).execute()
-        sb.table("face_clusters").delete().eq("album_id", album_id).execute()
-        sb.table("photos").delete().eq("album_id", album_id).execute()
-        sb.table("jobs").delete().eq("album_id", album_id).execute()
-        sb.table("albums").delete().eq("id", album_id).execute()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            jobs_f = pool.submit(_execute, sb.table("jobs").delete().eq("album_id", album_id), read=False)
+
+            # in_() viaja en la query string: por lotes para no pasar el límite de URL
+            for batch in _chunked(photo_ids, PGREST_IN_BATCH):
+                _execute(sb.table("photo_faces").delete().in_("photo_id", batch), read=False)
+
+            _execute(sb.table("face_embeddings").delete().eq("album_id", album_id), read=False)
+            _execute(sb.table("face_clusters").delete().eq("album_id", album_id), read=False)
+            _execute(sb.table("photos").delete().eq("album_id", album_id), read=False)
+            jobs_f.result()
+        _execute(sb.table("albums").delete().eq("id", album_id), read=False)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"DB cleanup failed: {str(e)}")
+    finally:
+        _JOB_STATUS_CACHE.pop(album_id)
+        _CLUSTERS_CACHE.pop(album_id)
 
     return {
         "ok": True,
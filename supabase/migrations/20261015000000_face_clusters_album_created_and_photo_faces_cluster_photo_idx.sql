@@ -0,0 +1,8 @@
+-- list_clusters: where album_id = $1 order by created_at
+-- (igualdad primero, rango/orden después => index scan ya ordenado, sin Sort)
+create index if not exists face_clusters_album_created_idx
+  on public.face_clusters (album_id, created_at);
+
+-- /photos, /download, /download-manifest: photos ⨝ photo_faces!inner filtrado por cluster_id
+create index if not exists photo_faces_cluster_photo_idx
+  on public.photo_faces (cluster_id, photo_id);
@@ -0,0 +1,6 @@
+-- Recovery code por álbum (/process los escribe al crear un álbum nuevo;
+-- _require_album_access exige el código si access_code_hash no es null).
+-- Álbumes previos quedan con null => siguen accesibles sin código (backward compat).
+alter table public.albums add column if not exists access_code_hash text;
+alter table public.albums add column if not exists access_code_hint text;
+alter table public.albums add column if not exists access_code_created_at timestamptz;
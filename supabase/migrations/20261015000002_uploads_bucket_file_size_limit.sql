@@ -0,0 +1,9 @@
+-- /upload-request firma URLs de subida directa a Storage; la URL firmada no
+-- limita el tamaño, así que el tope lo pone el bucket. Debe coincidir con
+-- MAX_ZIP_MB (default 50 => 52428800 bytes): la API chequea al arrancar que
+-- file_size_limit exista y sea <= MAX_ZIP_MB, y si no, /upload-request responde 503.
+-- Si SUPABASE_BUCKET_UPLOADS no es "uploads", ajustar el id.
+update storage.buckets
+set file_size_limit = 52428800
+where id = 'uploads'
+  and (file_size_limit is null or file_size_limit > 52428800);
@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+
+import main
+
+ORIGIN = main.ALLOWED_ORIGINS[0]
+client = TestClient(main.app)
+
+
+def test_oversized_upload_413_carries_cors_headers():
+    # Content-Length declarado por encima del límite: el middleware corta sin leer el body
+    too_big = main.MAX_ZIP_MB * 1024 * 1024 + main._MULTIPART_OVERHEAD_BYTES + 1
+    res = client.post(
+        "/upload",
+        content=b"x",
+        headers={
+            "Origin": ORIGIN,
+            "Content-Type": "multipart/form-data; boundary=x",
+            "Content-Length": str(too_big),
+        },
+    )
+    assert res.status_code == 413
+    assert res.json() == {"detail": f"ZIP too large. Max {main.MAX_ZIP_MB}MB"}
+    assert res.headers["access-control-allow-origin"] == ORIGIN
+
+
+def test_rejected_upload_400_carries_cors_headers():
+    res = client.post(
+        "/upload",
+        files={"file": ("photos.txt", b"not a zip", "text/plain")},
+        headers={"Origin": ORIGIN},
+    )
+    assert res.status_code == 400
+    assert res.headers["access-control-allow-origin"] == ORIGIN
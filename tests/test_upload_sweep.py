@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+KEY_A = "zips/" + "a" * 32 + ".zip"
+KEY_B = "zips/" + "b" * 32 + ".zip"
+
+
+def _key(i: int) -> str:
+    return f"zips/{i:032x}.zip"
+
+
+def _obj(key: str, age_seconds: float) -> dict:
+    created = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    return {"name": key[len("zips/"):], "created_at": created.isoformat().replace("+00:00", "Z")}
+
+
+class FakeBucket:
+    def __init__(self, objects):
+        self.objects = objects
+        self.list_calls = []
+        self.removed = []
+
+    def list(self, path, opts):
+        self.list_calls.append(opts["offset"])
+        desc = opts["sortBy"]["order"] == "desc"
+        ordered = sorted(self.objects, key=lambda o: o["created_at"] or "", reverse=desc)
+        return ordered[opts["offset"]:opts["offset"] + opts["limit"]]
+
+
+class FakeQuery:
+    def __init__(self):
+        self.keys = []
+
+    def select(self, *_):
+        return self
+
+    def in_(self, column, values):
+        assert column == "upload_key"
+        self.keys = list(values)
+        return self
+
+
+@pytest.fixture
+def sweep(monkeypatch):
+    """Wires the sweeper to an in-memory bucket; returns (bucket, referenced keys)."""
+    bucket = FakeBucket([])
+    referenced = set()
+    sb = SimpleNamespace(
+        storage=SimpleNamespace(from_=lambda _: bucket),
+        table=lambda _: FakeQuery(),
+    )
+    monkeypatch.setattr(main, "supabase_admin", lambda: sb)
+    monkeypatch.setattr(
+        main, "_execute",
+        lambda q: SimpleNamespace(data=[{"upload_key": k} for k in q.keys if k in referenced]),
+    )
+    monkeypatch.setattr(main, "_bulkhead_remove", lambda b, paths: b.removed.extend(paths))
+    monkeypatch.setattr(main, "UNCONFIRMED_UPLOAD_TTL_SECONDS", 1000)
+    monkeypatch.setattr(main, "UPLOAD_SWEEP_WINDOW_SECONDS", 500)
+    return bucket, referenced
+
+
+def test_sweep_removes_only_window_objects(sweep):
+    bucket, _ = sweep
+    bucket.objects = [
+        _obj(KEY_A, 100),    # dentro del TTL
+        _obj(KEY_B, 1200),   # en la ventana
+        _obj(_key(1), 5000),  # anterior a la ventana
+    ]
+    assert main._sweep_unconfirmed_uploads() == 1
+    assert bucket.removed == [KEY_B]
+
+
+def test_sweep_pages_through_window(sweep, monkeypatch):
+    monkeypatch.setattr(main, "_SWEEP_PAGE", 2)
+    bucket, _ = sweep
+    keys = [_key(i) for i in range(5)]
+    bucket.objects = [_obj(k, 1100 + i) for i, k in enumerate(keys)]
+    assert main._sweep_unconfirmed_uploads() == 5
+    assert sorted(bucket.removed) == sorted(keys)
+    assert bucket.list_calls == [0, 2, 4]
+
+
+def test_sweep_stops_listing_before_window(sweep, monkeypatch):
+    monkeypatch.setattr(main, "_SWEEP_PAGE", 2)
+    bucket, _ = sweep
+    # más nuevo -> más viejo: 1 en la ventana, luego historia vieja que no se pagina
+    bucket.objects = [_obj(KEY_A, 1100)] + [_obj(_key(i), 10_000 + i) for i in range(10)]
+    assert main._sweep_unconfirmed_uploads() == 1
+    assert bucket.removed == [KEY_A]
+    assert bucket.list_calls == [0]
+
+
+def test_sweep_skips_referenced_and_foreign_names(sweep):
+    bucket, referenced = sweep
+    referenced.add(KEY_A)
+    bucket.objects = [
+        _obj(KEY_A, 1100),
+        _obj(KEY_B, 1100),
+        {"name": "notes.txt", "created_at": _obj(KEY_B, 1100)["created_at"]},
+        {"name": "c" * 32 + ".zip", "created_at": None},
+    ]
+    assert main._sweep_unconfirmed_uploads() == 1
+    assert bucket.removed == [KEY_B]
+
+
+def test_sweep_without_candidates_skips_albums_query(sweep, monkeypatch):
+    bucket, _ = sweep
+    bucket.objects = [_obj(KEY_A, 10)]
+    monkeypatch.setattr(main, "_execute", lambda q: pytest.fail("unexpected albums query"))
+    assert main._sweep_unconfirmed_uploads() == 0
+
+
+@pytest.mark.parametrize(
+    "key, ok",
+    [
+        (KEY_A, True),
+        ("zips/" + "A" * 32 + ".zip", True),
+        ("zips/" + "a" * 31 + ".zip", False),
+        ("zips/" + "g" * 32 + ".zip", False),
+        ("zips/../" + "a" * 29 + ".zip", False),
+        ("other/" + "a" * 32 + ".zip", False),
+        ("zips/" + "a" * 32 + ".tar", False),
+        ("", False),
+    ],
+)
+def test_is_upload_key(key, ok):
+    assert main._is_upload_key(key) is ok
+
+
+def test_check_upload_token(monkeypatch):
+    monkeypatch.setattr(main, "ALBUM_CODE_SALT", "salt")
+    monkeypatch.setattr(main, "_UPLOAD_TOKEN_KEY", b"k" * 32)
+    token = main._sign_upload_key(KEY_A)
+    assert main._check_upload_token(KEY_A, token)
+    assert not main._check_upload_token(KEY_B, token)
+    assert not main._check_upload_token(KEY_A, None)
+    assert not main._check_upload_token(KEY_A, token[:-1] + ("0" if token[-1] != "0" else "1"))
+
+
+def test_check_upload_token_without_salt(monkeypatch):
+    monkeypatch.setattr(main, "ALBUM_CODE_SALT", "")
+    assert main._sign_upload_key(KEY_A) is None
+    assert not main._check_upload_token(KEY_A, "anything")